@@ -1,24 +1,49 @@
 # =========================
 # Vaex EDA utilities
 # =========================
+# Vaex only pays off on large data (~10M+ rows). The Streamlit app
+# (app.py) works on the small countries table with pandas instead,
+# which is faster below ~1M rows.
 from __future__ import annotations
 
+import os
 from typing import List, Optional, Union, Dict, Any
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import vaex
 
 
 # -------------------------
 # 1) Load
 # -------------------------
-def load_vaex_df(path: str) -> vaex.dataframe.DataFrame:
+def load_vaex_df(path: str, lazy: bool = False) -> vaex.dataframe.DataFrame:
     """
     Load dataset into a Vaex DataFrame.
     Supports: .parquet, .hdf5, .csv (csv may be slower for big files)
+
+    If an .hdf5 file with the same name sits next to a .parquet path, it is
+    preferred (Vaex memory-maps HDF5, so queries are fast from the start).
+    Parquet is read eagerly into memory by default: Vaex's lazy Parquet
+    reader re-reads chunks on every query. Pass lazy=True to keep the lazy
+    path (less RAM, slower queries).
     """
-    p = path.lower()
-    if p.endswith(".parquet") or p.endswith(".hdf5"):
+    root, ext = os.path.splitext(path)
+    ext = ext.lower()
+
+    if ext == ".hdf5":
         return vaex.open(path)
-    elif p.endswith(".csv"):
+    elif ext == ".parquet":
+        # Prefer an HDF5 copy next to the file (memory-mapped by Vaex)
+        hdf5_path = root + ".hdf5"
+        if os.path.exists(hdf5_path):
+            return vaex.open(hdf5_path)
+        if lazy:
+            return vaex.open(path)
+        table = pq.read_table(path, memory_map=True)
+        return vaex.from_arrow_table(table)
+    elif ext == ".csv":
         # CSV -> Vaex can read, but for large file Parquet is recommended
         return vaex.from_csv(path, convert=False, copy_index=False)
     else:
@@ -32,24 +57,24 @@ def clean_countries(vx: vaex.dataframe.DataFrame) -> vaex.dataframe.DataFrame:
     """
     Minimal cleaning:
     - Fill missing capital -> 'Unknown'
-    - Ensure population & area are valid
-    - Create density column
+    - Ensure population & area are valid (both columns required)
+    - Create density column (always present in the output)
     """
-    vx2 = vx.copy()
+    names = frozenset(vx.get_column_names())
+    if "population" not in names or "area" not in names:
+        raise ValueError("population and area columns are required")
+
+    # Filter invalid numeric with one combined predicate, then drop the
+    # filtered rows once so the mask isn't re-evaluated by every query
+    vx2 = vx[(vx.population > 0) & (vx.area > 0)].extract()
 
     # Fill null capital
-    if "capital" in vx2.get_column_names():
+    if "capital" in names:
         vx2["capital"] = vx2.capital.fillna("Unknown")
 
-    # Filter invalid numeric
-    if "population" in vx2.get_column_names():
-        vx2 = vx2[vx2.population > 0]
-    if "area" in vx2.get_column_names():
-        vx2 = vx2[vx2.area > 0]
-
-    # Create density
-    if "population" in vx2.get_column_names() and "area" in vx2.get_column_names():
-        vx2["density"] = vx2.population / vx2.area
+    # Create density (materialized: computed once, not on every query)
+    vx2["density"] = vx2.population / vx2.area
+    vx2 = vx2.materialize("density")
 
     return vx2
 
@@ -69,18 +94,23 @@ def filter_countries(
     min_pop: minimum population
     max_pop: optional maximum population
     """
+    names = frozenset(vx.get_column_names())
     vx_f = vx
 
     # Region filter
-    if region is not None and "region" in vx_f.get_column_names():
+    if region is not None and "region" in names:
         if isinstance(region, str):
             region_list = [region]
         else:
             region_list = region
-        vx_f = vx_f[vx_f.region.isin(region_list)]
+        if len(region_list) == 1:
+            # Plain equality is cheaper than a set-membership test
+            vx_f = vx_f[vx_f.region == region_list[0]]
+        else:
+            vx_f = vx_f[vx_f.region.isin(region_list)]
 
     # Population filter
-    if "population" in vx_f.get_column_names():
+    if "population" in names:
         vx_f = vx_f[vx_f.population >= min_pop]
         if max_pop is not None:
             vx_f = vx_f[vx_f.population <= max_pop]
@@ -91,6 +121,30 @@ def filter_countries(
 # -------------------------
 # 4) Top N
 # -------------------------
+_TOP_COLS = ("cca3", "name_common", "region", "population", "area", "density")
+
+
+def _top_k(
+    vx: vaex.dataframe.DataFrame,
+    values: np.ndarray,
+    n: int,
+    cols: List[str],
+) -> vaex.dataframe.DataFrame:
+    """
+    Rows holding the n largest `values`, in descending order.
+    Partial sort (argpartition) + sort of the n winners only.
+    """
+    k = min(n, len(values))
+    if k <= 0:
+        # head(0)/[0:0] don't give an empty frame in vaex; filter everything out
+        return vx[cols].filter("False").extract()
+    idx = np.argpartition(-values, k - 1)[:k]
+    # Back to row order first so the stable sort breaks ties by position
+    idx.sort()
+    idx = idx[np.argsort(-values[idx], kind="stable")]
+    return vx[cols].take(idx)
+
+
 def top_population(
     vx: vaex.dataframe.DataFrame,
     n: int = 10,
@@ -98,13 +152,15 @@ def top_population(
 ) -> vaex.dataframe.DataFrame:
     """
     Top N countries by population.
+    Expects a frame from clean_countries() (density column present).
     """
+    if "density" not in vx.get_column_names():
+        raise ValueError("density column not found. Run clean_countries() first or create vx['density'].")
+
     if cols is None:
-        cols = ["cca3", "name_common", "region", "population", "area"]
-        if "density" in vx.get_column_names():
-            cols.append("density")
+        cols = list(_TOP_COLS)
 
-    return vx.sort("population", ascending=False)[cols].head(n)
+    return _top_k(vx, vx.population.to_numpy(), n, cols)
 
 
 def top_density(
@@ -119,9 +175,9 @@ def top_density(
         raise ValueError("density column not found. Run clean_countries() first or create vx['density'].")
 
     if cols is None:
-        cols = ["cca3", "name_common", "region", "population", "area", "density"]
+        cols = list(_TOP_COLS)
 
-    return vx.sort("density", ascending=False)[cols].head(n)
+    return _top_k(vx, vx.density.to_numpy(), n, cols)
 
 
 # -------------------------
@@ -134,19 +190,20 @@ def agg_by_region(vx: vaex.dataframe.DataFrame) -> vaex.dataframe.DataFrame:
     - avg area
     - number of countries
     """
-    if "region" not in vx.get_column_names():
+    names = frozenset(vx.get_column_names())
+    if "region" not in names:
         raise ValueError("region column not found")
 
     agg_map = {
         "country_count": vaex.agg.count(),
     }
-    if "population" in vx.get_column_names():
+    if "population" in names:
         agg_map["total_population"] = vaex.agg.sum("population")
         agg_map["avg_population"] = vaex.agg.mean("population")
-    if "area" in vx.get_column_names():
+    if "area" in names:
         agg_map["avg_area"] = vaex.agg.mean("area")
 
-    if "density" in vx.get_column_names():
+    if "density" in names:
         agg_map["avg_density"] = vaex.agg.mean("density")
 
     return vx.groupby(by="region", agg=agg_map).sort("country_count", ascending=False)
@@ -160,27 +217,46 @@ def descriptive_stats(vx: vaex.dataframe.DataFrame) -> Dict[str, Dict[str, Any]]
     Return min/max/mean for population & density (if exist).
     Outputs as Python scalars for easy printing/report.
     """
-    out: Dict[str, Dict[str, Any]] = {}
-
-    if "population" in vx.get_column_names():
-        out["population"] = {
-            "min": vx.population.min().item(),
-            "mean": vx.population.mean().item(),
-            "max": vx.population.max().item(),
+    names = frozenset(vx.get_column_names())
+    cols = [c for c in ("population", "density", "area") if c in names]
+    if not cols:
+        return {}
+
+    # Schedule all aggregates, then run them in a single pass over the data
+    tasks = {
+        col: {
+            "min": vx.min(col, delay=True),
+            "mean": vx.mean(col, delay=True),
+            "max": vx.max(col, delay=True),
         }
+        for col in cols
+    }
+    vx.execute()
 
-    if "density" in vx.get_column_names():
-        out["density"] = {
-            "min": vx.density.min().item(),
-            "mean": vx.density.mean().item(),
-            "max": vx.density.max().item(),
-        }
+    return {
+        col: {stat: task.get().item() for stat, task in stats.items()}
+        for col, stats in tasks.items()
+    }
 
-    if "area" in vx.get_column_names():
-        out["area"] = {
-            "min": vx.area.min().item(),
-            "mean": vx.area.mean().item(),
-            "max": vx.area.max().item(),
-        }
 
-    return out
+# -------------------------
+# 7) Display
+# -------------------------
+def vx_to_arrow(
+    vx: vaex.dataframe.DataFrame,
+    cols: Optional[List[str]] = None,
+    n: Optional[int] = None,
+) -> pa.Table:
+    """
+    Convert (the first n rows of) a Vaex DataFrame to a pyarrow Table.
+    st.dataframe / st.bar_chart accept Arrow tables directly, so this
+    skips the round-trip through pandas.
+    """
+    if cols is not None:
+        vx = vx[cols]
+    if n is not None and (n <= 0 or len(vx) == 0):
+        # head(0) returns every row in vaex; filter everything out instead
+        vx = vx.filter("False").extract()
+    elif n is not None:
+        vx = vx.head(n)
+    return vx.to_arrow_table()
@@ -3,26 +3,34 @@ import pandas as pd
 
 st.set_page_config(page_title="Countries Analytics", layout="wide")
 
-@st.cache_data
+@st.cache_resource
 def load_data():
-    df = pd.read_parquet("countries_eda.parquet")
+    df = pd.read_parquet("countries_eda.parquet", engine="pyarrow", memory_map=True)
     df["density"] = df["population"] / df["area"]
     return df
 
-df = load_data()
+@st.cache_data
+def filter_data(region: tuple, min_pop: int):
+    df = load_data()
+    if region:
+        df = df[df["region"].isin(region)]
+    df = df[df["population"] >= min_pop]
+    return df.sort_values("population", ascending=False), len(df), int(df["population"].sum())
+
+@st.cache_data(show_spinner=False)
+def load_regions():
+    return sorted(load_data()["region"].dropna().unique())
 
 # Sidebar
 region = st.sidebar.multiselect(
     "Region",
-    options=sorted(df["region"].dropna().unique())
+    options=load_regions()
 )
 min_pop = st.sidebar.number_input("Min population", value=0, step=1_000_000)
 
-if region:
-    df = df[df["region"].isin(region)]
-df = df[df["population"] >= min_pop]
+df, n_countries, total_pop = filter_data(tuple(region), min_pop)
 
-st.metric("Countries", len(df))
-st.metric("Total population", int(df.population.sum()))
+st.metric("Countries", n_countries)
+st.metric("Total population", total_pop)
 
-st.dataframe(df.sort_values("population", ascending=False))
+st.dataframe(df)